@@ -1,11 +1,48 @@
-﻿import os, json, time, pathlib, re, subprocess, textwrap
-from jsonschema import validate
+﻿import os, sys, json, time, pathlib, re, subprocess, textwrap, hashlib, shlex, random
+import functools, types
+import collections, threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter, Retry
 import yaml
 
+# orjson (C имплементација) е ~3-5× побрз на decode/encode; stdlib како fallback
+try:
+    import orjson
+
+    def jdumps(obj, pretty=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0).decode("utf-8")
+
+    def jloads(s):
+        return orjson.loads(s)
+except ImportError:
+    def jdumps(obj, pretty=False):
+        return json.dumps(obj, ensure_ascii=False, indent=2 if pretty else None)
+
+    def jloads(s):
+        return json.loads(s)
+
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 DOCS = ROOT / "docs"
 STATUS = DOCS / "status.json"
+LAST_LOGS = DOCS / "last_logs.txt"
+
+def _make_session():
+    # Keep-alive pool: еден TCP+TLS handshake наместо по еден за секој повик
+    s = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers["Connection"] = "keep-alive"
+    return s
+
+SESSION_GH = _make_session()
+SESSION_OLLAMA = _make_session()
+
+_YAML_RE = re.compile(r"```yaml\s*(.*?)```", re.DOTALL | re.IGNORECASE)
 
 INSTRUCTION_SCHEMA = {
     "type": "object",
@@ -19,7 +56,9 @@ INSTRUCTION_SCHEMA = {
                     "name": {"type": "string"},
                     "cmd": {"type": "string"},
                     "cwd": {"type": "string"},
-                    "timeout": {"type": "integer"}
+                    "timeout": {"type": "integer"},
+                    "parallel": {"type": "boolean"},
+                    "group": {"type": "integer"}
                 },
                 "required": ["cmd"]
             }
@@ -28,45 +67,111 @@ INSTRUCTION_SCHEMA = {
     "required": []
 }
 
+# Компајлиран валидатор (специјализирана функција) наместо интерпретативниот
+# jsonschema walk при секоја итерација; stdlib-чистиот jsonschema е fallback.
+try:
+    import fastjsonschema
+    _validate_instruction = fastjsonschema.compile(INSTRUCTION_SCHEMA)
+except ImportError:
+    from jsonschema import validate as _jsonschema_validate
+
+    # чист dict за fallback-от — jsonschema го одбива mappingproxy view-то подолу
+    _SCHEMA_DICT = INSTRUCTION_SCHEMA
+
+    def _validate_instruction(instr):
+        _jsonschema_validate(instr, _SCHEMA_DICT)
+        return instr
+
+# read-only поглед: валидаторот е компајлиран со претпоставка дека шемата не мутира
+INSTRUCTION_SCHEMA = types.MappingProxyType(INSTRUCTION_SCHEMA)
+
 def load_event():
     # GitHub ја дава патеката во оваа env променлива
     p = os.environ.get("GITHUB_EVENT_PATH")
     if not p or not os.path.exists(p):
         return {}
     with open(p, "r", encoding="utf-8") as f:
-        return json.load(f)
+        return jloads(f.read())
 
 def gh_api(path, method="GET", json_body=None):
     token = os.environ.get("GITHUB_TOKEN")
     repo = os.environ.get("GITHUB_REPOSITORY") or os.environ.get("GH_REPO")
     if not token or not repo:
         raise RuntimeError("GITHUB_TOKEN/GITHUB_REPOSITORY missing")
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github+json",
-    }
+    if "Authorization" not in SESSION_GH.headers:
+        # auth header-ите се градат еднаш и живеат во session defaults
+        SESSION_GH.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github+json",
+        })
     base = f"https://api.github.com/repos/{repo}"
     url = f"{base}{path}"
-    r = requests.request(method, url, json=json_body, headers=headers, timeout=60)
+    r = SESSION_GH.request(method, url, json=json_body, timeout=60)
     r.raise_for_status()
     return r.json()
 
-def post_issue_comment(number: int, body: str):
+# Еден worker: POST-овите не го блокираат главниот loop, а редоследот е зачуван.
+_comment_pool = ThreadPoolExecutor(max_workers=1)
+
+def _do_post(number: int, body: str):
     try:
         gh_api(f"/issues/{number}/comments", method="POST", json_body={"body": body})
     except Exception as e:
         print(f"[warn] post_issue_comment failed: {e}")
 
+def _log_future_exc(fut):
+    e = fut.exception()
+    if e:
+        print(f"[warn] comment worker: {e}")
+
+def post_issue_comment(number: int, body: str):
+    _comment_pool.submit(_do_post, number, body).add_done_callback(_log_future_exc)
+
+_pending_comments = []
+
+def queue_comment(summary: str, body: str = ""):
+    # Настаните од една итерација се собираат и одат како еден коментар —
+    # еден GitHub POST наместо по еден за секоја команда.
+    if body:
+        _pending_comments.append(f"<details><summary>{summary}</summary>\n\n{body}\n\n</details>")
+    else:
+        _pending_comments.append(summary)
+
+def flush_comments(number):
+    if not _pending_comments:
+        return
+    body = "\n\n---\n\n".join(_pending_comments)
+    _pending_comments.clear()
+    if number:
+        post_issue_comment(number, body)
+
+_STATUS_CACHE = None
+
 def update_status(data: dict):
+    # Статусот се држи во меморија — без read-modify-write на целиот JSON при секоја фаза.
+    global _STATUS_CACHE
     DOCS.mkdir(parents=True, exist_ok=True)
-    payload = {}
-    if STATUS.exists():
-        try:
-            payload = json.loads(STATUS.read_text(encoding="utf-8"))
-        except Exception:
-            payload = {}
-    payload.update(data)
-    STATUS.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    if _STATUS_CACHE is None:
+        _STATUS_CACHE = {}
+        if STATUS.exists():
+            try:
+                _STATUS_CACHE = jloads(STATUS.read_text(encoding="utf-8"))
+            except Exception:
+                _STATUS_CACHE = {}
+        # мигрирај го наследениот клуч од постари статуси — логовите живеат
+        # во last_logs.txt и не смеат да се ресеријализираат застарени тука
+        _STATUS_CACHE.pop("last_logs", None)
+    data = dict(data)
+    logs = data.pop("last_logs", None)
+    if logs is not None:
+        # логовите одат во посебен фајл за да не се ресеријализираат со секој статус
+        LAST_LOGS.write_text(logs, encoding="utf-8")
+    if not any(_STATUS_CACHE.get(k) != v for k, v in data.items()):
+        return
+    _STATUS_CACHE.update(data)
+    tmp = STATUS.with_suffix(".json.tmp")
+    tmp.write_text(jdumps(_STATUS_CACHE, pretty=os.environ.get("AMAL_PRETTY") == "1"), encoding="utf-8")
+    os.replace(tmp, STATUS)
 
 def detect_issue_context(ev: dict):
     if ev.get("issue"):
@@ -84,7 +189,7 @@ def parse_acceptance(issue_body: str):
       timeout: 30
     ```
     """
-    m = re.search(r"```yaml\s*(.*?)```", issue_body, re.DOTALL | re.IGNORECASE)
+    m = _YAML_RE.search(issue_body)
     if not m:
         return None
     try:
@@ -96,32 +201,166 @@ def parse_acceptance(issue_body: str):
         return None
     return None
 
+# Колку аутпут чуваме од една команда: опашка од 64 линии, линиите капнати на 4 KB.
+_MAX_CMD_LINES = 64
+_MAX_LINE_LEN = 4096
+
+def _as_argv(cmd: str):
+    # Проста команда без shell метазнаци → argv листа, без fork на /bin/sh.
+    # На Windows (cmd.exe) останува shell=True; shlex е POSIX-семантика.
+    if os.name != "posix" or any(c in cmd for c in "|&;<>$`*?(){}[]\"'~#\\\n"):
+        return cmd, True
+    argv = shlex.split(cmd)
+    if not argv or "=" in argv[0]:
+        # FOO=bar cmd е env-префикс само во shell; како argv би се exec-нал "FOO=bar"
+        return cmd, True
+    return argv, False
+
 def run_cmd(cmd, cwd=None, timeout=180):
     start = time.time()
-    p = subprocess.Popen(cmd, cwd=cwd or str(ROOT), shell=True,
-                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    args, use_shell = _as_argv(cmd)
     try:
-        out, _ = p.communicate(timeout=timeout)
-        code = p.returncode
-    except subprocess.TimeoutExpired:
+        p = subprocess.Popen(args, cwd=cwd or str(ROOT), shell=use_shell,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError as e:
+        # без shell нема кој да врати 127 — симулирај го однесувањето
+        return 127, f"[spawn failed] {e}", round(time.time() - start, 2)
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
         p.kill()
-        out = f"[TIMEOUT after {timeout}s]"
-        code = -9
+
+    killer = threading.Timer(timeout, _kill)
+    killer.start()
+    # Ring buffer наместо communicate(): меморијата останува рамна и при MB-ски аутпут.
+    buf = collections.deque(maxlen=_MAX_CMD_LINES)
+    nlines = 0
+    try:
+        for line in iter(p.stdout.readline, ""):
+            nlines += 1
+            buf.append(line[-_MAX_LINE_LEN:])
+        p.stdout.close()
+        code = p.wait()
+    finally:
+        killer.cancel()
     dur = round(time.time() - start, 2)
+    out = "".join(buf)
+    if nlines > _MAX_CMD_LINES:
+        out = f"[... truncated to last {_MAX_CMD_LINES} of {nlines} lines ...]\n" + out
+    if timed_out.is_set():
+        out = f"[TIMEOUT after {timeout}s]\n" + out
+        code = -9
     return code, out, dur
 
 def apply_patch(patch_text: str):
     if not patch_text or not patch_text.strip():
         return True, "No patch provided"
-    tmp = ROOT / ".amal" / "tmp.patch"
-    tmp.parent.mkdir(parents=True, exist_ok=True)
-    tmp.write_text(patch_text, encoding="utf-8")
-    # git apply е достапен (runner има git). -p0 бидејќи ќе даваме целосни патеки во diff-овите
-    code, out, _ = run_cmd(f'git apply -p0 --whitespace=nowarn -v "{tmp.as_posix()}"', cwd=str(ROOT), timeout=90)
-    if code != 0:
-        return False, f"git apply failed (code {code}). Output:\n{out}"
+    # git apply е достапен (runner има git). -p0 бидејќи ќе даваме целосни патеки во diff-овите.
+    # Патчот оди на stdin — без tmp фајл на диск и без shell форк околу git.
+    try:
+        p = subprocess.run(
+            ["git", "apply", "-p0", "--recount", "--whitespace=nowarn", "-v", "-"],
+            cwd=str(ROOT), input=patch_text, capture_output=True, text=True, timeout=90)
+    except subprocess.TimeoutExpired:
+        return False, "git apply failed: timeout after 90s"
+    if p.returncode != 0:
+        out = (p.stdout or "") + (p.stderr or "")
+        return False, f"git apply failed (code {p.returncode}). Output:\n{out}"
     return True, "Patch applied"
 
+CACHE_DIR = ROOT / ".amal" / "cache"
+CACHE_TTL = int(os.environ.get("AMAL_CACHE_TTL", "86400"))
+_MEM_CACHE = {}
+
+def _cache_enabled():
+    return os.environ.get("AMAL_CACHE") == "1"
+
+def _cache_key(payload: dict) -> str:
+    blob = json.dumps({"model": payload["model"], "messages": payload["messages"]}, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _cache_get(key: str):
+    if key in _MEM_CACHE:
+        return _MEM_CACHE[key]
+    f = CACHE_DIR / f"{key}.json"
+    if not f.exists():
+        return None
+    try:
+        entry = jloads(f.read_text(encoding="utf-8"))
+        if time.time() - entry.get("ts", 0) > entry.get("ttl", CACHE_TTL):
+            return None
+        _MEM_CACHE[key] = entry["result"]
+        return entry["result"]
+    except Exception:
+        return None
+
+def _cache_put(key: str, result: dict):
+    _MEM_CACHE[key] = result
+    if len(_MEM_CACHE) > 128:
+        _MEM_CACHE.pop(next(iter(_MEM_CACHE)))
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_DIR / f"{key}.json.tmp"
+    tmp.write_text(jdumps({"ts": time.time(), "ttl": CACHE_TTL, "result": result}), encoding="utf-8")
+    os.replace(tmp, CACHE_DIR / f"{key}.json")
+
+def _find_json_object(s: str):
+    # Линеарен скен со балансирани загради; грабливиот `\{.*\}` regex
+    # бектрекира патолошки на расипан модел-аутпут.
+    depth = 0
+    start = -1
+    in_str = False
+    esc = False
+    for i, ch in enumerate(s):
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                return s[start:i + 1]
+    return None
+
+def _extract_json(content: str):
+    # Очекуваме JSON. Ако има текст околу него, извлечи го првиот JSON објект.
+    try:
+        return jloads(content)
+    except Exception:
+        frag = _find_json_object(content)
+        if frag:
+            try:
+                return jloads(frag)
+            except Exception:
+                return None
+        return None
+
+# Колку долго серверот да го држи моделот вчитан; default-от од 5 мин може
+# да истече помеѓу бавни итерации и повторното вчитување чини секунди.
+KEEP_ALIVE = os.environ.get("AMAL_KEEP_ALIVE", "1h")
+
+def warm_ollama():
+    # Празен generate како префлајт: вчитувањето на моделот се плаќа пред
+    # првата вистинска итерација, не во неа.
+    base = os.environ.get("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+    model = os.environ.get("AMAL_MODEL", "llama3.1")
+    try:
+        SESSION_OLLAMA.post(f"{base}/api/generate",
+                            json={"model": model, "prompt": "", "keep_alive": KEEP_ALIVE},
+                            timeout=120)
+    except Exception as e:
+        print(f"[warn] ollama warmup failed: {e}")
+
 def call_ollama(system_prompt: str, user_prompt: str) -> dict:
     base = os.environ.get("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
     model = os.environ.get("AMAL_MODEL", "llama3.1")
@@ -132,41 +371,230 @@ def call_ollama(system_prompt: str, user_prompt: str) -> dict:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
-        "stream": False,
-        "options": {"temperature": 0.2}
+        "stream": True,
+        # cache_prompt + num_keep: серверот го задржува KV-кешот за статичниот префикс;
+        # експлицитни num_ctx/num_predict за KV-алокација со фиксна големина
+        "keep_alive": KEEP_ALIVE,
+        "options": {
+            "temperature": 0.2,
+            "cache_prompt": True,
+            "num_keep": max(64, len(system_prompt) // 4),
+            "num_ctx": int(os.environ.get("AMAL_NUM_CTX", "8192")),
+            "num_predict": int(os.environ.get("AMAL_NUM_PREDICT", "2048")),
+        },
     }
-    r = requests.post(url, json=payload, timeout=600)
+    # Детерминистички повик (иста порака, исти опции) → кеширај по SHA-256
+    key = _cache_key(payload) if _cache_enabled() else None
+    if key:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+    # NDJSON стриминг: парсирај инкрементално и прекини штом се склопи цел JSON
+    r = SESSION_OLLAMA.post(url, json=payload, stream=True, timeout=600)
     r.raise_for_status()
-    data = r.json()
-    content = data.get("message", {}).get("content", "")
-    # Очекуваме JSON. Ако има текст околу него, извлечи го првиот JSON објект.
+    content = ""
+    result = None
     try:
-        return json.loads(content)
-    except Exception:
-        m = re.search(r"\{.*\}", content, re.DOTALL)
-        if m:
-            return json.loads(m.group(0))
+        for line in r.iter_lines():
+            if not line:
+                continue
+            chunk = jloads(line)
+            content += chunk.get("message", {}).get("content", "")
+            if content.rstrip().endswith("}"):
+                result = _extract_json(content)
+                if result is not None:
+                    break
+            if chunk.get("done"):
+                break
+    finally:
+        r.close()
+    if result is None:
+        result = _extract_json(content)
+    if result is None:
         raise RuntimeError("Model did not return JSON")
+    if key:
+        _cache_put(key, result)
+    return result
 
-def build_system_prompt():
-    return textwrap.dedent("""
+# Темплејтите се dedent-нати еднаш при import, не при секое градење на промпт.
+SYSTEM_PROMPT_STATIC = textwrap.dedent("""
     You are a strict coding agent. Output a SINGLE JSON object with fields:
       - "patch": (optional) unified diff to apply at repo root
-      - "commands": array of { "name"?:string, "cmd":string, "cwd"?:string, "timeout"?:int }
+      - "commands": array of { "name"?:string, "cmd":string, "cwd"?:string, "timeout"?:int, "parallel"?:bool, "group"?:int }
+    Independent commands may set "parallel": true with the same "group" to run concurrently.
     No explanations. JSON only.
     Prefer idempotent, Windows-friendly commands. Avoid destructive actions.
+
+    Repo files (truncated):
     """)
 
+USER_PROMPT_TEMPLATE = textwrap.dedent("""
+    Task Title: {issue_title}
+
+    Task Body:
+    {issue_body}
+
+    ---DYNAMIC---
+    Iteration: {iteration}
+
+    Last logs (truncated):
+    {last_logs}
+
+    Acceptance (summary):
+    {acc_desc}
+    """)
+
+@functools.lru_cache(maxsize=4)
+def build_system_prompt(files_list: str):
+    # Сè статично (улога, шема, листа на фајлови) живее тука, за да може
+    # llama.cpp да го реискористи KV-кешот на префиксот во секоја итерација.
+    return SYSTEM_PROMPT_STATIC + files_list
+
+def _dedupe_consecutive(lines):
+    # соседни идентични линии (чест случај кај traceback-ови и ретрај-логови)
+    # се колабираат во една + бројач, без загуба на информација
+    out = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j < len(lines) and lines[j] == lines[i]:
+            j += 1
+        out.append(lines[i])
+        if j - i > 1:
+            out.append(f"[... previous line repeated {j - i - 1} more times ...]")
+        i = j
+    return out
+
+def tail_lines(s: str, max_chars: int) -> str:
+    # опашка сечена на граница на линија — карактерскиот slice [-N:] почнуваше
+    # среде линија (па и среде UTF-8 секвенца) и трошеше токени на шум
+    acc = []
+    n = 0
+    for L in reversed(_dedupe_consecutive(s.splitlines())):
+        if n + len(L) + 1 > max_chars:
+            # предолга линија не смее да ја избрише целата опашка (run_cmd
+            # дозволува линии до 4 KB) — сечи ја на преостанатиот буџет
+            rem = max_chars - n - 1
+            if rem > 0:
+                acc.append(L[-rem:])
+            break
+        acc.append(L)
+        n += len(L) + 1
+    return "\n".join(reversed(acc))
+
+def build_user_prompt(issue_title, issue_body, iteration, last_logs, acc_desc):
+    # Статичното (наслов, тело) оди прво; сè што мутира по итерација — строго последно.
+    return USER_PROMPT_TEMPLATE.format(
+        issue_title=issue_title,
+        issue_body=issue_body,
+        iteration=iteration,
+        last_logs=tail_lines(last_logs, 1200),
+        acc_desc=acc_desc,
+    )
+
+_SKIP_DIRS = {".git", "node_modules", "__pycache__"}
+_FILES = None
+_FILES_CACHE = None
+
 def list_files(max_len=2000):
-    items = []
-    for p in ROOT.rglob("*"):
-        if any(part.startswith(".git") for part in p.parts):
-            continue
-        if p.is_file():
-            rel = p.relative_to(ROOT).as_posix()
-            items.append(rel)
-    s = "\n".join(items)
-    return s[:max_len]
+    # scandir DFS со кастрење на .git/node_modules на ниво на walk —
+    # rglob("*") слегуваше низ илјадници .git објекти само за да ги филтрира после.
+    global _FILES, _FILES_CACHE
+    if _FILES is None or os.environ.get("AMAL_FORCE_RESCAN") == "1":
+        items = []
+        total = 0
+        stack = [str(ROOT)]
+        while stack and total <= max_len * 1.1:
+            d = stack.pop()
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.name in _SKIP_DIRS:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        # кешот на одговори (chunk полн со <sha256>.json) не е
+                        # содржина на репото — би го потрошил буџетот на листата
+                        if entry.path == str(CACHE_DIR):
+                            continue
+                        stack.append(entry.path)
+                    else:
+                        rel = os.path.relpath(entry.path, ROOT).replace(os.sep, "/")
+                        items.append(rel)
+                        total += len(rel) + 1
+        _FILES = set(items)
+        _FILES_CACHE = "\n".join(sorted(_FILES))
+    if len(_FILES_CACHE) <= max_len:
+        return _FILES_CACHE
+    # сечи на граница на линија, не среде патека
+    return _FILES_CACHE[:max_len].rsplit("\n", 1)[0]
+
+# git header-ите не колидираат со hunk содржина (body линиите почнуваат со
+# ' ', '+' или '-'); "---"/"+++" се валидни само како соседен пар линии.
+_DIFF_GIT_RE = re.compile(r"^diff --git (?:a/)?(\S+) (?:b/)?(\S+)", re.MULTILINE)
+_NEW_MODE_RE = re.compile(r"^new file mode", re.MULTILINE)
+_DEL_MODE_RE = re.compile(r"^deleted file mode", re.MULTILINE)
+_OLD_NEW_PAIR_RE = re.compile(r"^--- (\S+)\r?\n\+\+\+ (\S+)", re.MULTILINE)
+
+def _norm_diff_path(tok: str) -> str:
+    return tok[2:] if tok.startswith(("a/", "b/")) else tok
+
+def _patch_file_pairs(patch_text: str):
+    # (old, new) по фајл; "/dev/null" означува додавање/бришење
+    heads = list(_DIFF_GIT_RE.finditer(patch_text))
+    if heads:
+        pairs = []
+        for i, m in enumerate(heads):
+            end = heads[i + 1].start() if i + 1 < len(heads) else len(patch_text)
+            # само header-зоната пред првиот hunk
+            header = patch_text[m.end():end].split("\n@@", 1)[0]
+            old, new = m.group(1), m.group(2)
+            if _DEL_MODE_RE.search(header):
+                pairs.append((old, "/dev/null"))
+            elif _NEW_MODE_RE.search(header):
+                pairs.append(("/dev/null", new))
+            else:
+                pairs.append((old, new))
+        return pairs
+    # чист unified diff без git header-и: барај само соседни ---/+++ парови
+    return _OLD_NEW_PAIR_RE.findall(patch_text)
+
+def update_files_from_patch(patch_text: str) -> bool:
+    # Наместо повторен walk по секој успешен патч, листата се ажурира
+    # инкрементално од header-ите на diff-от. Враќа дали нешто се смени.
+    global _FILES_CACHE
+    if _FILES is None or not patch_text:
+        return False
+    changed = False
+    for old, new in _patch_file_pairs(patch_text):
+        old, new = _norm_diff_path(old), _norm_diff_path(new)
+        if new == "/dev/null":
+            if old in _FILES:
+                _FILES.discard(old)
+                changed = True
+        else:
+            if new not in _FILES:
+                _FILES.add(new)
+                changed = True
+            if old not in ("/dev/null", new) and old in _FILES:
+                _FILES.discard(old)
+                changed = True
+    if changed:
+        _FILES_CACHE = "\n".join(sorted(_FILES))
+    return changed
+
+def _command_groups(cmds):
+    # Последователни команди со "parallel": true и ист "group" се извршуваат заедно;
+    # сè друго останува сериско како досега.
+    groups = []
+    for i, c in enumerate(cmds):
+        key = ("p", c.get("group")) if c.get("parallel") else ("s", i)
+        if groups and groups[-1][0] == key:
+            groups[-1][1].append(c)
+        else:
+            groups.append((key, [c]))
+    return [g for _, g in groups]
+
+def _run_one(c):
+    return run_cmd(c["cmd"], cwd=c.get("cwd", str(ROOT)), timeout=int(c.get("timeout", 180)))
 
 def main():
     ev = load_event()
@@ -178,37 +606,41 @@ def main():
     if issue_no:
         post_issue_comment(issue_no, f"🚀 Amal стартува. Acceptance={acc_desc}")
 
-    system_prompt = build_system_prompt()
+    # Префлајтот оди во позадина и се преклопува со скенирањето на репото
+    # и стартните статус/коментар повици; чекаме дури пред првиот model call.
+    with ThreadPoolExecutor(max_workers=1) as warm_pool:
+        warm_future = warm_pool.submit(warm_ollama)
+        files_list = list_files()
+        system_prompt = build_system_prompt(files_list)
+        warm_future.result()
     iteration = 1
     max_iter = 4
     last_logs = ""
-    files_list = list_files()
+    retries = 0
 
     while iteration <= max_iter:
         update_status({"phase": "iterating", "iteration": iteration, "progress": int((iteration-1)/max_iter*100)})
 
-        user_prompt = textwrap.dedent(f"""
-        Task Title: {issue_title}
-
-        Task Body:
-        {issue_body}
-
-        Iteration: {iteration}
-
-        Repo files (truncated):
-        {files_list}
-
-        Last logs (truncated):
-        {last_logs[-1200:]}
+        user_prompt = build_user_prompt(issue_title, issue_body, iteration, last_logs, acc_desc)
 
-        Acceptance (summary):
-        {acc_desc}
-        """)
+        # Пауза само по ретрајабилна грешка (експоненцијално + jitter);
+        # успешна итерација продолжува веднаш.
+        if retries:
+            time.sleep(min(30, 0.5 * 2 ** retries) + random.uniform(0, 0.25))
 
         try:
             instr = call_ollama(system_prompt, user_prompt)
-            validate(instr, INSTRUCTION_SCHEMA)
+            _validate_instruction(instr)
+            retries = 0
+        except requests.RequestException as e:
+            retries += 1
+            msg = f"⚠️ Model call failed on iter {iteration} (retryable): {e}"
+            print(f"[warn] {msg}")
+            update_status({"error": msg})
+            iteration += 1
+            continue
         except Exception as e:
+            # детерминистички лош аутпут нема да се поправи со свеж повик — прекини
             msg = f"❌ Invalid model output on iter {iteration}: {e}"
             if issue_no: post_issue_comment(issue_no, msg)
             update_status({"error": msg})
@@ -218,51 +650,61 @@ def main():
         patch_msg = "No patch"
         if instr.get("patch"):
             ok, patch_msg = apply_patch(instr["patch"])
-            if issue_no:
-                post_issue_comment(issue_no, f"🩹 Patch: {('OK' if ok else 'FAIL')}\n```\n{patch_msg[:4000]}\n```")
+            queue_comment(f"🩹 Patch: {('OK' if ok else 'FAIL')}", f"```\n{patch_msg[:4000]}\n```")
+            if ok and update_files_from_patch(instr["patch"]):
+                files_list = list_files()
+                system_prompt = build_system_prompt(files_list)
             if not ok:
+                flush_comments(issue_no)
                 last_logs = patch_msg
                 iteration += 1
                 continue
 
-        # Изврши команди
+        # Изврши команди (групите се fail-fast: паднат чекор не пушта нова група)
         run_logs = []
-        cmds = instr.get("commands", [])
-        for i, c in enumerate(cmds, start=1):
-            cmd = c["cmd"]
-            cwd = c.get("cwd", str(ROOT))
-            timeout = int(c.get("timeout", 180))
-            code, out, dur = run_cmd(cmd, cwd=cwd, timeout=timeout)
-            run_logs.append(f"$ {cmd}\n# exit={code}, {dur}s\n{out}")
-            if issue_no:
-                post_issue_comment(issue_no, f"🔧 Команда {i}: `{cmd}` → exit={code}\n```\n{out[:3000]}\n```")
-            if code != 0:
+        i = 0
+        failed = False
+        for group in _command_groups(instr.get("commands", [])):
+            if len(group) > 1:
+                with ThreadPoolExecutor(max_workers=min(4, len(group))) as ex:
+                    results = list(ex.map(_run_one, group))
+            else:
+                results = [_run_one(group[0])]
+            for c, (code, out, dur) in zip(group, results):
+                i += 1
+                run_logs.append(f"$ {c['cmd']}\n# exit={code}, {dur}s\n{out}")
+                queue_comment(f"🔧 Команда {i}: `{c['cmd']}` → exit={code}", f"```\n{out[:3000]}\n```")
+                if code != 0:
+                    failed = True
+            if failed:
                 break
 
-        last_logs = patch_msg + "\n\n" + "\n\n---\n\n".join(run_logs)
+        # чувај само опашка со фиксна големина — сè понатаму работи врз ограничен string
+        last_logs = (patch_msg + "\n\n" + "\n\n---\n\n".join(run_logs))[-4000:]
         update_status({"last_logs": last_logs[-3500:]})
 
         # Acceptance
         if acceptance:
             code, out, _ = run_cmd(acceptance["cmd"], cwd=str(ROOT), timeout=int(acceptance.get("timeout", 60)))
             passed = (code == 0 and acceptance["expect_contains"] in out)
-            if issue_no:
-                post_issue_comment(issue_no, f"🧪 Acceptance: exit={code}\n```\n{out[:3000]}\n```")
+            queue_comment(f"🧪 Acceptance: exit={code}", f"```\n{out[:3000]}\n```")
+            flush_comments(issue_no)
             if passed:
                 update_status({"phase": "done", "progress": 100, "result": "passed"})
+                # финалниот исход оди како посебен POST за да пукне нотификација
                 if issue_no: post_issue_comment(issue_no, "✅ **Acceptance PASSED**. Задачата е готова.")
                 print("[Amal] DONE (acceptance passed)")
                 return
             else:
                 if issue_no: post_issue_comment(issue_no, "⚠️ Acceptance NOT met. Итерација понатаму.")
         else:
+            flush_comments(issue_no)
             update_status({"phase": "done_no_accept", "progress": 100})
             if issue_no: post_issue_comment(issue_no, "ℹ️ Нема ACCEPT. Завршив една итерација.")
             print("[Amal] DONE (no acceptance defined)")
             return
 
         iteration += 1
-        time.sleep(2)
 
     update_status({"phase": "failed", "result": "max_iterations"})
     if issue_no:
@@ -270,5 +712,14 @@ def main():
     print("[Amal] FAIL (max iterations)")
     raise SystemExit(1)
 
+def smoke():
+    # брза проверка на статус-патеката, без GitHub/Ollama
+    update_status({"phase": "smoke", "ts": int(time.time()), "progress": 100})
+    print("[Amal] SMOKE OK")
+
 if __name__ == "__main__":
-    main()
+    try:
+        smoke() if "--smoke" in sys.argv else main()
+    finally:
+        # испразни ги заостанатите коментари пред излез
+        _comment_pool.shutdown(wait=True)
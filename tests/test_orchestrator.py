@@ -0,0 +1,154 @@
+import importlib
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / ".amal"))
+
+import orchestrator
+
+
+VALID_INSTR = {"patch": "", "commands": [{"cmd": "echo hi"}]}
+INVALID_INSTR = {"commands": [{"name": "no cmd here"}]}
+
+
+def test_validator_compiled_path():
+    orchestrator._validate_instruction(VALID_INSTR)
+    with pytest.raises(Exception):
+        orchestrator._validate_instruction(INVALID_INSTR)
+
+
+def test_validator_jsonschema_fallback(monkeypatch):
+    # симулирај отсутен fastjsonschema: import-от мора да падне на jsonschema,
+    # а валидаторот да работи и покрај замрзнатата шема
+    monkeypatch.setitem(sys.modules, "fastjsonschema", None)
+    try:
+        mod = importlib.reload(orchestrator)
+        mod._validate_instruction(VALID_INSTR)
+        with pytest.raises(Exception):
+            mod._validate_instruction(INVALID_INSTR)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(orchestrator)
+
+
+def test_schema_is_frozen():
+    with pytest.raises(TypeError):
+        orchestrator.INSTRUCTION_SCHEMA["required"] = ["patch"]
+
+
+def _fresh_files(monkeypatch, files):
+    monkeypatch.setattr(orchestrator, "_FILES", set(files))
+    monkeypatch.setattr(orchestrator, "_FILES_CACHE", "\n".join(sorted(files)))
+
+
+def test_patch_pairs_from_git_headers():
+    patch = (
+        "diff --git a/old.py b/old.py\n"
+        "deleted file mode 100644\n"
+        "--- a/old.py\n+++ /dev/null\n@@ -1 +0,0 @@\n-x\n"
+        "diff --git a/new.py b/new.py\n"
+        "new file mode 100644\n"
+        "--- /dev/null\n+++ b/new.py\n@@ -0,0 +1 @@\n+x\n"
+        "diff --git a/from.py b/to.py\n"
+        "--- a/from.py\n+++ b/to.py\n@@ -1 +1 @@\n-x\n+y\n"
+    )
+    assert orchestrator._patch_file_pairs(patch) == [
+        ("old.py", "/dev/null"),
+        ("/dev/null", "new.py"),
+        ("from.py", "to.py"),
+    ]
+
+
+def test_hunk_body_dashes_do_not_create_phantom_files(monkeypatch):
+    _fresh_files(monkeypatch, {"keep.py", "mod.py"})
+    patch = (
+        "diff --git a/mod.py b/mod.py\n"
+        "--- a/mod.py\n+++ b/mod.py\n"
+        "@@ -1,2 +1,1 @@\n"
+        "-- this removed line starts with dashes\n"
+        " context\n"
+    )
+    assert orchestrator.update_files_from_patch(patch) is False
+    assert orchestrator._FILES == {"keep.py", "mod.py"}
+
+
+def test_plain_diff_pairs_require_adjacency(monkeypatch):
+    _fresh_files(monkeypatch, {"a.py"})
+    patch = "--- /dev/null\n+++ b.py\n@@ -0,0 +1 @@\n+x\n"
+    assert orchestrator.update_files_from_patch(patch) is True
+    assert "b.py" in orchestrator._FILES
+    # body линија што личи на header, без соседен "+++" — не е header
+    noise = "--- a.py\n@@ -1 +1 @@\n--- not a header\n+y\n"
+    assert orchestrator.update_files_from_patch(noise) is False
+    assert orchestrator._FILES == {"a.py", "b.py"}
+
+
+def test_list_files_skips_response_cache(tmp_path, monkeypatch):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.py").write_text("x")
+    amal = tmp_path / ".amal"
+    cache = amal / "cache"
+    cache.mkdir(parents=True)
+    (cache / ("0" * 64 + ".json")).write_text("{}")
+    (amal / "orchestrator.py").write_text("#")
+    monkeypatch.setattr(orchestrator, "ROOT", tmp_path)
+    monkeypatch.setattr(orchestrator, "CACHE_DIR", cache)
+    monkeypatch.setattr(orchestrator, "_FILES", None)
+    s = orchestrator.list_files()
+    assert "src/a.py" in s and ".amal/orchestrator.py" in s
+    assert "0" * 64 not in s
+
+
+def test_tail_lines_truncates_oversized_line_instead_of_dropping():
+    long = "x" * 5000
+    t = orchestrator.tail_lines(long, 1200)
+    assert t == "x" * 1199  # опашка од линијата, не празен string
+    t = orchestrator.tail_lines("short\n" + long, 1200)
+    assert t.endswith("x" * 100) and len(t) <= 1200
+
+
+def test_as_argv_simple_command_skips_shell():
+    argv, use_shell = orchestrator._as_argv("python -V")
+    assert argv == ["python", "-V"] and use_shell is False
+
+
+@pytest.mark.parametrize("cmd", [
+    "echo a\necho b",          # повеќелиниска команда = две shell команди
+    "FOO=bar env",             # env-префикс
+    "echo a && echo b",
+    "cat < in.txt",
+    "ls ~",
+    "echo \\x",
+    "echo hi # comment",
+])
+def test_as_argv_shell_semantics_stay_in_shell(cmd):
+    assert orchestrator._as_argv(cmd)[1] is True
+
+
+def test_run_cmd_multiline_runs_both_commands():
+    code, out, _ = orchestrator.run_cmd("echo first\necho second", timeout=30)
+    assert code == 0
+    assert "first" in out and "second" in out
+    assert "first echo second" not in out
+
+
+def test_run_cmd_env_prefix():
+    code, out, _ = orchestrator.run_cmd("FOO=bar printenv FOO", timeout=30)
+    assert code == 0 and out.strip() == "bar"
+
+
+def test_update_status_migrates_legacy_last_logs(tmp_path, monkeypatch):
+    import json
+
+    status = tmp_path / "status.json"
+    status.write_text(json.dumps({"phase": "done", "last_logs": "stale"}), encoding="utf-8")
+    monkeypatch.setattr(orchestrator, "DOCS", tmp_path)
+    monkeypatch.setattr(orchestrator, "STATUS", status)
+    monkeypatch.setattr(orchestrator, "LAST_LOGS", tmp_path / "last_logs.txt")
+    monkeypatch.setattr(orchestrator, "_STATUS_CACHE", None)
+    orchestrator.update_status({"phase": "start", "last_logs": "fresh"})
+    written = json.loads(status.read_text(encoding="utf-8"))
+    assert "last_logs" not in written and written["phase"] == "start"
+    assert orchestrator.LAST_LOGS.read_text(encoding="utf-8") == "fresh"